@@ -3,14 +3,19 @@ import numpy as np
 import pandas as pd
 from PIL import Image
 import cv2
-from skimage.metrics import structural_similarity as ssim
-import easyocr
-from deepface import DeepFace
-from pdf2image import convert_from_bytes
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm
-import tempfile, os, re, datetime
+import os, re, io, datetime, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+
+# easyocr, deepface, pdf2image, reportlab, pyarrow, numba and diskcache are imported
+# where they are used so the page renders without loading torch/tensorflow.
+
+AADHAAR_RE = re.compile(r"\d{4}\s*\d{4}\s*\d{4}|\d{12}")
+PAN_RE = re.compile(r"[A-Z]{5}[0-9]{4}[A-Z]", re.IGNORECASE)
+# OCR text holds Aadhaar/PAN numbers: keep the cache somewhere controlled and let entries expire
+OCR_CACHE_DIR = os.environ.get("FRAUDGUARD_OCR_CACHE_DIR", os.path.expanduser("~/.fraudguard_ocr_cache"))
+OCR_CACHE_TTL = int(os.environ.get("FRAUDGUARD_OCR_CACHE_TTL", 24 * 60 * 60))
+# in-memory image caches are keyed on upload bytes; bound them so a long-lived server doesn't grow without limit
+IMAGE_CACHE_ENTRIES, IMAGE_CACHE_TTL = 64, 60 * 60
 
 # ---------------------------
 # Page config
@@ -45,23 +50,200 @@ st.markdown(
 # ---------------------------
 # Helper functions
 # ---------------------------
-def load_image(uploaded_file):
+_REDUCED_FLAGS = {
+    "L": {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8},
+    "RGB": {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8},
+}
+
+def decode_array(buf: bytes, mode: str = "RGB", size: int | None = None) -> np.ndarray:
+    if buf[:4] == b"%PDF":
+        from pdf2image import convert_from_bytes
+        return np.asarray(convert_from_bytes(buf)[0].convert(mode))
+    flag = cv2.IMREAD_GRAYSCALE if mode == "L" else cv2.IMREAD_COLOR
+    if size and buf[:2] == b"\xff\xd8":
+        # JPEG: let libjpeg-turbo downscale in the DCT domain, keeping both sides >= size
+        w, h = Image.open(io.BytesIO(buf)).size  # header only, no pixel decode
+        factor = next((f for f in (8, 4, 2) if min(w, h) // f >= size), 1)
+        flag = _REDUCED_FLAGS[mode].get(factor, flag)
+    arr = cv2.imdecode(np.frombuffer(buf, np.uint8), flag)
+    if arr is None:
+        raise ValueError("Unsupported or corrupt image file.")
+    return arr if mode == "L" else cv2.cvtColor(arr, cv2.COLOR_BGR2RGB)
+
+def load_array(uploaded_file, mode: str = "RGB"):
     if uploaded_file is None:
         return None
-    name = uploaded_file.name.lower()
-    if name.endswith(".pdf"):
-        pages = convert_from_bytes(uploaded_file.read())
-        return pages[0]
+    return decode_array(uploaded_file.getvalue(), mode)
+
+def fast_ssim(a, b, win=11, sigma=1.5, L=255):
+    a, b = a.astype(np.float32), b.astype(np.float32)
+    blur = lambda x: cv2.GaussianBlur(x, (win, win), sigma)
+    c1, c2 = (0.01 * L) ** 2, (0.03 * L) ** 2
+    mu1, mu2 = blur(a), blur(b)
+    mu1_sq, mu2_sq, mu1_mu2 = mu1 * mu1, mu2 * mu2, mu1 * mu2
+    sigma1_sq = blur(a * a) - mu1_sq
+    sigma2_sq = blur(b * b) - mu2_sq
+    sigma12 = blur(a * b) - mu1_mu2
+    ssim_map = ((2 * mu1_mu2 + c1) * (2 * sigma12 + c2)) / ((mu1_sq + mu2_sq + c1) * (sigma1_sq + sigma2_sq + c2))
+    score = float(ssim_map.mean())
+    return score, ssim_map
+
+@st.cache_data(max_entries=IMAGE_CACHE_ENTRIES, ttl=IMAGE_CACHE_TTL)
+def _load_gray(buf: bytes, size: int) -> np.ndarray:
+    return cv2.resize(decode_array(buf, "L", size), (size, size), interpolation=cv2.INTER_AREA)
+
+@st.cache_resource
+def get_ssim_kernel():
+    try:
+        from ssim_numba import ssim_mean
+    except ImportError:
+        return None
+    g = cv2.getGaussianKernel(11, 1.5).ravel().astype(np.float32)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    # sessions share this kernel; numba's workqueue threading layer aborts the
+    # process on concurrent parallel calls, so serialize them
+    lock = threading.Lock()
+    failed = False
+
+    def kernel(a, b):
+        nonlocal failed
+        if not failed:
+            try:
+                with lock:
+                    return float(ssim_mean(a.astype(np.float32), b.astype(np.float32), g, c1, c2))
+            except Exception:
+                failed = True  # JIT or runtime failure: use OpenCV from now on
+        return fast_ssim(a, b)[0]
+
+    # JIT-compile off the script thread so the first compare doesn't wait for it
+    warm = np.zeros((600, 600), np.uint8)
+    threading.Thread(target=kernel, args=(warm, warm), daemon=True).start()
+    return kernel
+
+@st.cache_data(max_entries=IMAGE_CACHE_ENTRIES, ttl=IMAGE_CACHE_TTL)
+def _ssim_pair(b1: bytes, b2: bytes, size: int, full: bool = True) -> tuple[float, bytes | None]:
+    a1, a2 = _load_gray(b1, size), _load_gray(b2, size)
+    # identical pixels need no SSIM
+    if np.array_equal(a1, a2):
+        return 1.0, None
+    kernel = get_ssim_kernel()
+    if kernel is not None:
+        score, diff = kernel(a1, a2), None
     else:
-        return Image.open(uploaded_file)
+        score, diff = fast_ssim(a1, a2)
+    # the diff map only tells the user something in the "minor differences" band
+    if not (full and 0.6 < score <= 0.9):
+        return score, None
+    if diff is None:
+        diff = fast_ssim(a1, a2)[1]
+    _, diff_png = cv2.imencode(".png", (diff * 255).astype("uint8"))
+    return score, diff_png.tobytes()
+
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=3)
+
+@st.cache_resource
+def get_reader(langs=("en",), gpu=True):
+    import easyocr
+    return easyocr.Reader(list(langs), gpu=gpu, cudnn_benchmark=True)
+
+@st.cache_resource
+def get_batch_reader():
+    reader = get_reader()
+    # the first batched call pays for cudnn autotuning; spend it on a dummy batch
+    reader.readtext_batched(np.zeros([2, 600, 800, 3], np.uint8), n_width=800, n_height=600)
+    return reader
+
+@st.cache_resource
+def get_ocr_cache():
+    from diskcache import Cache
+    # owner-only: the cached text contains ID numbers
+    os.makedirs(OCR_CACHE_DIR, mode=0o700, exist_ok=True)
+    os.chmod(OCR_CACHE_DIR, 0o700)
+    cache = Cache(OCR_CACHE_DIR)
+    cache.expire()  # diskcache only drops expired entries lazily; purge leftovers from earlier runs
+    return cache
+
+def _pad_to(img: np.ndarray, width: int, height: int) -> np.ndarray:
+    # letterbox with white so readtext_batched's resize keeps the aspect ratio
+    h, w = img.shape[:2]
+    th, tw = max(h, round(w * height / width)), max(w, round(h * width / height))
+    top, left = (th - h) // 2, (tw - w) // 2
+    return cv2.copyMakeBorder(img, top, th - h - top, left, tw - w - left, cv2.BORDER_CONSTANT, value=(255, 255, 255))
 
-def generate_report_pdf(output_path: str, data: dict):
-    c = canvas.Canvas(output_path, pagesize=A4)
+def ocr_texts(bufs: list[bytes]) -> list[str]:
+    from importlib.metadata import version
+    # the text depends on the file, the EasyOCR release and how readtext is called;
+    # batched OCR letterboxes cards to 800x600, so it gets its own key
+    model_key = f"easyocr-{version('easyocr')}|en|detail0-paragraph"
+    digests = [hashlib.sha256(b).hexdigest() for b in bufs]
+    full_key = lambda d: f"{d}|{model_key}|full"
+    batched_key = lambda d: f"{d}|{model_key}|batched800x600pad"
+    cache = get_ocr_cache()
+    texts = [cache.get(full_key(d)) for d in digests]
+    if len(bufs) >= 2:
+        # a batch request can reuse either pipeline's result
+        texts = [t if t is not None else cache.get(batched_key(d)) for t, d in zip(texts, digests)]
+    misses = [i for i, t in enumerate(texts) if t is None]
+    if not misses:
+        return texts
+    # rasterize in the pool while the reader loads (and warms up, for batches)
+    futures = {i: get_executor().submit(decode_array, bufs[i]) for i in misses}
+    # PDFs render as A4 pages, far too small at 800x600: only batch photos/scans
+    batch = [i for i in misses if bufs[i][:4] != b"%PDF"]
+    if len(batch) < 2:
+        batch = []
+    if batch:
+        imgs = [_pad_to(futures[i].result(), 800, 600) for i in batch]
+        results = get_batch_reader().readtext_batched(imgs, n_width=800, n_height=600, detail=0, paragraph=True)
+        for i, res in zip(batch, results):
+            texts[i] = " ".join(res)
+            cache.set(batched_key(digests[i]), texts[i], expire=OCR_CACHE_TTL)
+    for i in misses:
+        if i not in batch:
+            texts[i] = " ".join(get_reader().readtext(futures[i].result(), detail=0, paragraph=True))
+            cache.set(full_key(digests[i]), texts[i], expire=OCR_CACHE_TTL)
+    cache.expire()
+    return texts
+
+def show_aadhaar(text: str, key=None):
+    st.text_area("Extracted Text", text, height=220, key=key)
+    found = AADHAAR_RE.search(text)
+    if found:
+        st.success(f"Aadhaar-like number found: {found.group()}")
+    else:
+        st.warning("No 12-digit Aadhaar number detected.")
+
+def show_pan(text: str, key=None):
+    st.text_area("Extracted Text", text, height=220, key=key)
+    found = PAN_RE.search(text)
+    if found:
+        st.success(f"PAN-like number found: {found.group().upper()}")
+    else:
+        st.warning("PAN number not confidently detected.")
+
+@st.cache_resource
+def get_face_model(name="VGG-Face"):
+    from deepface import DeepFace
+    return DeepFace.build_model(name)
+
+def generate_report_pdf(sink, data: dict):
+    from xml.sax.saxutils import escape
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen import canvas
+    from reportlab.platypus import Frame, Paragraph
+
+    c = canvas.Canvas(sink, pagesize=A4)
     w, h = A4
+    body = ParagraphStyle("ReportBody", fontName="Helvetica", fontSize=10, leading=12)
     c.setFont("Helvetica-Bold", 16)
     c.drawString(20*mm, h - 20*mm, "Banking Fraud Guard - Fraud Detection Report")
     c.setFont("Helvetica", 10)
-    c.drawString(20*mm, h - 26*mm, f"Generated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    generated = data.get("generated") or datetime.datetime.now()
+    c.drawString(20*mm, h - 26*mm, f"Generated: {generated.strftime('%Y-%m-%d %H:%M:%S')}")
     if data.get("customer_name"):
         c.drawString(20*mm, h - 32*mm, f"Customer: {data['customer_name']}")
     if data.get("reference"):
@@ -83,7 +265,11 @@ def generate_report_pdf(output_path: str, data: dict):
         if val is None:
             c.drawString(20*mm, y, "Not analyzed")
         elif isinstance(val, str):
-            c.drawString(20*mm, y, val[:200].replace("\n", " ") + "...")
+            p = Paragraph(escape(val[:200].replace("\n", " ") + "..."), body)
+            _, ph = p.wrap(w - 40*mm, y)
+            # drawOn anchors the bottom edge; line the first baseline up with y
+            p.drawOn(c, 20*mm, y + body.fontSize - ph)
+            y -= ph - body.leading
         else:
             c.drawString(20*mm, y, f"{val}")
         y -= 8*mm
@@ -92,14 +278,30 @@ def generate_report_pdf(output_path: str, data: dict):
     c.setFont("Helvetica-Bold", 12)
     c.drawString(20*mm, y, "Remarks")
     y -= 6*mm
-    c.setFont("Helvetica", 10)
-    for line in (remarks[i:i+90] for i in range(0, len(remarks), 90)):
-        c.drawString(20*mm, y, line)
-        y -= 6*mm
+    story = [Paragraph(escape(remarks).replace("\n", "<br/>"), body)]
+    top = y + body.fontSize
+    # fill what is left of the page, split the paragraph at the bottom edge and carry on overleaf
+    while story:
+        frame = Frame(20*mm, 20*mm, w - 40*mm, top - 20*mm, leftPadding=0, rightPadding=0,
+                      topPadding=0, bottomPadding=0)
+        frame.addFromList(story, c)
+        if story:
+            parts = frame.split(story[0], c)
+            if parts:
+                frame.add(parts[0], c)
+                story[:1] = parts[1:]
+            if story:
+                c.showPage()
+                top = h - 20*mm
 
     c.showPage()
     c.save()
 
+def render_report_pdf(data: dict) -> bytes:
+    buf = io.BytesIO()
+    generate_report_pdf(buf, data)
+    return buf.getvalue()
+
 # ---------------------------
 # Initialize session
 # ---------------------------
@@ -133,12 +335,8 @@ with tabs[0]:
         if not (orig and sus):
             st.error("Please upload both files.")
         else:
-            pil1 = load_image(orig).convert("L").resize((600,600))
-            pil2 = load_image(sus).convert("L").resize((600,600))
-            a1, a2 = np.array(pil1), np.array(pil2)
-            score, diff = ssim(a1, a2, full=True)
-            st.session_state.forgery_score = float(score)
-            diff_img = (diff * 255).astype("uint8")
+            score, diff_png = _ssim_pair(orig.getvalue(), sus.getvalue(), 600)
+            st.session_state.forgery_score = score
             st.write(f"Similarity Score: {score:.3f}")
             if score > 0.9:
                 st.success("No forgery detected.")
@@ -146,7 +344,11 @@ with tabs[0]:
                 st.warning("Minor differences detected.")
             else:
                 st.error("High chance of forgery.")
-            st.image([pil1, pil2, diff_img], caption=["Original","Suspect","Diff Map"], width=250)
+            a1, a2 = _load_gray(orig.getvalue(), 600), _load_gray(sus.getvalue(), 600)
+            if diff_png is None:
+                st.image([a1, a2], caption=["Original","Suspect"], width=250)
+            else:
+                st.image([a1, a2, diff_png], caption=["Original","Suspect","Diff Map"], width=250)
 
 # ---- SIGNATURE ----
 with tabs[1]:
@@ -161,10 +363,8 @@ with tabs[1]:
         if not (sig_orig and sig_sus):
             st.error("Upload both signatures.")
         else:
-            p1 = load_image(sig_orig).convert("L").resize((300,300))
-            p2 = load_image(sig_sus).convert("L").resize((300,300))
-            sscore, _ = ssim(np.array(p1), np.array(p2), full=True)
-            st.session_state.signature_score = float(sscore)
+            sscore, _ = _ssim_pair(sig_orig.getvalue(), sig_sus.getvalue(), 300, full=False)
+            st.session_state.signature_score = sscore
             st.write(f"Signature Similarity: {sscore:.3f}")
             if sscore > 0.85:
                 st.success("Signatures appear genuine.")
@@ -172,6 +372,7 @@ with tabs[1]:
                 st.warning("Partial match - suspicious.")
             else:
                 st.error("Signatures likely forged.")
+            p1, p2 = _load_gray(sig_orig.getvalue(), 300), _load_gray(sig_sus.getvalue(), 300)
             st.image([p1, p2], caption=["Original Sig","Suspect Sig"], width=200)
 
 # ---- AADHAAR ----
@@ -182,17 +383,9 @@ with tabs[2]:
         if not aad:
             st.error("Upload Aadhaar file.")
         else:
-            reader = easyocr.Reader(["en"])
-            pil = load_image(aad).convert("RGB")
-            res = reader.readtext(np.array(pil))
-            text = " ".join([r[1] for r in res])
+            text = ocr_texts([aad.getvalue()])[0]
             st.session_state.aadhaar_text = text
-            st.text_area("Extracted Text", text, height=220)
-            found = re.findall(r"\d{4}\s*\d{4}\s*\d{4}|\d{12}", text)
-            if found:
-                st.success(f"Aadhaar-like number found: {found[0]}")
-            else:
-                st.warning("No 12-digit Aadhaar number detected.")
+            show_aadhaar(text)
 
 # ---- PAN ----
 with tabs[3]:
@@ -202,17 +395,20 @@ with tabs[3]:
         if not pan:
             st.error("Upload PAN file.")
         else:
-            reader_pan = easyocr.Reader(["en"])
-            pilp = load_image(pan).convert("RGB")
-            res = reader_pan.readtext(np.array(pilp))
-            textp = " ".join([r[1] for r in res])
+            textp = ocr_texts([pan.getvalue()])[0]
             st.session_state.pan_text = textp
-            st.text_area("Extracted Text", textp, height=220)
-            found = re.findall(r"[A-Z]{5}[0-9]{4}[A-Z]", textp.upper())
-            if found:
-                st.success(f"PAN-like number found: {found[0]}")
-            else:
-                st.warning("PAN number not confidently detected.")
+            show_pan(textp)
+
+    # Both cards uploaded: OCR whatever isn't cached as one batch
+    if st.button("Extract KYC Docs (Aadhaar + PAN)"):
+        if not (aad and pan):
+            st.error("Upload both Aadhaar and PAN files.")
+        else:
+            st.session_state.aadhaar_text, st.session_state.pan_text = ocr_texts([aad.getvalue(), pan.getvalue()])
+            st.subheader("Aadhaar")
+            show_aadhaar(st.session_state.aadhaar_text, key="batch_aad_text")
+            st.subheader("PAN")
+            show_pan(st.session_state.pan_text, key="batch_pan_text")
 
 # ---- KYC ----
 with tabs[4]:
@@ -227,7 +423,21 @@ with tabs[4]:
             st.error("Please upload both ID and live photos.")
         else:
             try:
-                res = DeepFace.verify(np.array(load_image(id_face)), np.array(load_image(live_face)), enforce_detection=False)
+                id_img, live_img = load_array(id_face), load_array(live_face)
+                if id_face.getvalue() == live_face.getvalue() or np.array_equal(id_img, live_img):
+                    # same photo uploaded twice: the face model would only confirm it
+                    res = {"distance": 0.0, "verified": True}
+                    st.caption("Photos are duplicates; face model skipped.")
+                else:
+                    from deepface import DeepFace
+                    get_face_model("VGG-Face")
+                    res = DeepFace.verify(
+                        id_img,
+                        live_img,
+                        model_name="VGG-Face",
+                        detector_backend="opencv",
+                        enforce_detection=False,
+                    )
                 st.session_state.face_distance = float(res.get("distance", 0.0))
                 st.session_state.face_verified = bool(res.get("verified", False))
                 st.write(f"Distance: {st.session_state.face_distance:.4f}")
@@ -247,13 +457,33 @@ with tabs[5]:
             st.error("Upload CSV.")
         else:
             try:
-                df = pd.read_csv(txn)
-                st.write(df.head())
-                if "amount" not in df.columns:
+                import pyarrow as pa
+                import pyarrow.csv as pac
+                buf = txn.getvalue()
+                head = pd.read_csv(io.BytesIO(buf), nrows=5)
+                st.write(head)
+                if "amount" not in head.columns:
                     st.warning("CSV must have 'amount' column.")
                 else:
-                    threshold = df["amount"].mean() + 3 * df["amount"].std()
-                    frauds = df[df["amount"] > threshold]
+                    # scoring pass: parse only the amount column
+                    tbl = pac.read_csv(
+                        pa.BufferReader(buf),
+                        convert_options=pac.ConvertOptions(column_types={"amount": pa.float32()}, include_columns=["amount"]),
+                    )
+                    a = tbl.column("amount").to_numpy()
+                    # accumulate in float64 so large files don't lose precision; NaNs skipped like pandas
+                    threshold = np.nanmean(a, dtype=np.float64) + 3 * np.nanstd(a, dtype=np.float64, ddof=1)
+                    idx = np.flatnonzero(a > threshold)
+                    # only parse the full rows when there is something to show; other columns stay
+                    # text so a late non-numeric value can't break arrow's first-block type inference
+                    display_types = {c: pa.string() for c in head.columns}
+                    display_types["amount"] = pa.float64()
+                    frauds = pac.read_csv(
+                        pa.BufferReader(buf),
+                        convert_options=pac.ConvertOptions(column_types=display_types),
+                    ).take(idx).to_pandas() if idx.size else head.iloc[:0]
+                    # keep the CSV row numbers so investigators can find flagged rows
+                    frauds.index = idx
                     st.session_state.transaction_frauds_count = len(frauds)
                     st.metric("Potential Fraud Transactions", len(frauds))
                     if not frauds.empty:
@@ -269,8 +499,8 @@ ref = st.text_input("Account / Reference number", "")
 remarks = st.text_area("Additional remarks", height=80)
 
 if st.button("Generate PDF Report"):
-    tmpd = tempfile.mkdtemp()
-    out_pdf = os.path.join(tmpd, f"fraud_report_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf")
+    generated = datetime.datetime.now()
+    file_name = f"fraud_report_{generated.strftime('%Y%m%d_%H%M%S')}.pdf"
     data = {
         "customer_name": cust_name,
         "reference": ref,
@@ -282,10 +512,13 @@ if st.button("Generate PDF Report"):
         "face_verified": st.session_state.face_verified,
         "transaction_frauds_count": st.session_state.transaction_frauds_count,
         "remarks": remarks,
+        "generated": generated,
     }
     try:
-        generate_report_pdf(out_pdf, data)
-        with open(out_pdf, "rb") as f:
-            st.download_button("📥 Download Fraud Report (PDF)", data=f, file_name=os.path.basename(out_pdf), mime="application/pdf")
+        pdf = render_report_pdf(data)
+        st.download_button("📥 Download Fraud Report (PDF)", data=pdf, file_name=file_name, mime="application/pdf")
     except Exception as e:
-        st.error(f"PDF generation error: {e}")
\ No newline at end of file
+        st.error(f"PDF generation error: {e}")
+
+# start the numba SSIM compile once the page has rendered
+get_ssim_kernel()
\ No newline at end of file
@@ -0,0 +1,67 @@
+import numpy as np
+from numba import njit, prange
+
+# ---------------------------
+# Fused SSIM kernel (optional, needs numba)
+# ---------------------------
+@njit(cache=True)
+def _reflect(i, n):
+    # cv2.BORDER_REFLECT_101, the GaussianBlur default, so scores match fast_ssim
+    if i < 0:
+        return -i
+    if i >= n:
+        return 2 * n - 2 - i
+    return i
+
+@njit(parallel=True, fastmath=True, cache=True)
+def ssim_mean(a, b, g, c1, c2):
+    h, w = a.shape
+    r = g.shape[0] // 2
+
+    # pad once so the filter loops below are branch-free and vectorize
+    pa = np.empty((h + 2 * r, w + 2 * r), np.float32)
+    pb = np.empty((h + 2 * r, w + 2 * r), np.float32)
+    for i in prange(h + 2 * r):
+        si = _reflect(i - r, h)
+        for j in range(w + 2 * r):
+            sj = _reflect(j - r, w)
+            pa[i, j] = a[si, sj]
+            pb[i, j] = b[si, sj]
+
+    # horizontal pass: x, y, x*x, y*y, x*y blurred along rows in one sweep
+    t = np.empty((5, h + 2 * r, w), np.float32)
+    for i in prange(h + 2 * r):
+        for j in range(w):
+            sx = sy = sxx = syy = sxy = np.float32(0)
+            for k in range(2 * r + 1):
+                wk = g[k]
+                x = pa[i, j + k]
+                y = pb[i, j + k]
+                sx += wk * x
+                sy += wk * y
+                sxx += wk * x * x
+                syy += wk * y * y
+                sxy += wk * x * y
+            t[0, i, j] = sx
+            t[1, i, j] = sy
+            t[2, i, j] = sxx
+            t[3, i, j] = syy
+            t[4, i, j] = sxy
+
+    # vertical pass fused with the SSIM map and the mean; the map is never stored
+    rows = np.empty(h, np.float64)
+    for i in prange(h):
+        mu = np.zeros((5, w), np.float32)
+        for k in range(2 * r + 1):
+            wk = g[k]
+            for q in range(5):
+                for j in range(w):
+                    mu[q, j] += wk * t[q, i + k, j]
+        acc = 0.0
+        for j in range(w):
+            m1, m2 = mu[0, j], mu[1, j]
+            num = (2 * m1 * m2 + c1) * (2 * (mu[4, j] - m1 * m2) + c2)
+            den = (m1 * m1 + m2 * m2 + c1) * ((mu[2, j] - m1 * m1) + (mu[3, j] - m2 * m2) + c2)
+            acc += num / den
+        rows[i] = acc
+    return rows.sum() / (h * w)
\ No newline at end of file